@@ -10,17 +10,24 @@ __status__ = "Production"
 
 import argparse
 import flask
-import requests
+import aiohttp
+import asyncio
 import threading
 import time
 import os
 import json
+import orjson
+import ijson
+import numpy
+import numba
 import errno
 import rrdtool
 import logging
 import calendar
 import sys
 import collections
+import concurrent.futures
+import functools
 import enum
 import werkzeug.wsgi
 import prometheus_client
@@ -48,6 +55,7 @@ class Config:
     billing_currency = os.getenv('KOA_BILLING_CURRENCY_SYMBOL', '$')
     enable_debug = (lambda v: v.lower() in ("yes", "true"))(os.getenv('KOA_ENABLE_DEBUG', 'false'))
     k8s_debug_auth_token = os.getenv('KOA_K8S_AUTH_TOKEN', 'DEBUG_TOKEN_NOT_FOUND')
+    rrdcached_socket = os.getenv('KOA_RRDCACHED_SOCKET', '')
 
     def __init__(self):
         try:
@@ -62,6 +70,7 @@ class Config:
             self.billing_hourly_rate = -1.0
 
         create_directory_if_not_exists(self.frontend_data_location)
+        create_directory_if_not_exists(self.db_location)
         with open(str('%s/backend.json' % self.frontend_data_location), 'w') as fd:
             if self.cost_model == 'CHARGE_BACK':
                 cost_model_label = 'Charge Back'
@@ -157,6 +166,9 @@ def render():
 
 
 class Node:
+    __slots__ = ('id', 'name', 'state', 'message', 'cpuCapacity', 'cpuAllocatable', 'cpuUsage',
+                 'memCapacity', 'memAllocatable', 'memUsage', 'containerRuntime', 'podsRunning', 'podsNotRunning')
+
     def __init__(self):
         self.id = ''
         self.name = ''
@@ -173,6 +185,8 @@ class Node:
         self.podsNotRunning = []
 
 class Pod:
+    __slots__ = ('name', 'namespace', 'id', 'nodeName', 'phase', 'state', 'cpuUsage', 'memUsage')
+
     def __init__(self):
         self.name = ''
         self.namespace = ''
@@ -180,51 +194,98 @@ class Pod:
         self.nodeName = ''
         self.phase = ''
         self.state = "PodNotScheduled"
+        self.cpuUsage = 0.0
+        self.memUsage = 0.0
 
 
 class ResourceUsage:
+    __slots__ = ('cpuUsage', 'memUsage')
+
     def __init__(self, cpuUsage, memUsage):
         self.cpuUsage = cpuUsage
         self.memUsage = memUsage
 
 
+def _encode_node(obj):
+    return {
+        'id': obj.id,
+        'name': obj.name,
+        'state': obj.state,
+        'message': obj.message,
+        'cpuCapacity': obj.cpuCapacity,
+        'cpuAllocatable': obj.cpuAllocatable,
+        'cpuUsage': obj.cpuUsage,
+        'memCapacity': obj.memCapacity,
+        'memAllocatable': obj.memAllocatable,
+        'memUsage': obj.memUsage,
+        'containerRuntime': obj.containerRuntime,
+        'podsRunning': obj.podsRunning,
+        'podsNotRunning': obj.podsNotRunning
+    }
+
+
+def _encode_pod(obj):
+    return {
+        'id': obj.id,
+        'name': obj.name,
+        'nodeName': obj.nodeName,
+        'phase': obj.phase,
+        'state': obj.state,
+        'cpuUsage': obj.cpuUsage,
+        'memUsage': obj.memUsage
+    }
+
+
+def _encode_resource_usage(obj):
+    return {
+        'cpuUsage': obj.cpuUsage,
+        'memUsage': obj.memUsage
+    }
+
+
+# O(1) encoder dispatch keyed by concrete type, shared by orjson and JSONMarshaller
+_ENCODERS = {Node: _encode_node, Pod: _encode_pod, ResourceUsage: _encode_resource_usage}
+
+
+def _encode_k8s_object(obj):
+    return _ENCODERS[type(obj)](obj)
+
+
 class JSONMarshaller(json.JSONEncoder):
     def default(self, obj):
-        if isinstance(obj, Node):
-            return {
-                'id': obj.id,
-                'name': obj.name,
-                'state': obj.state,
-                'message': obj.message,
-                'cpuCapacity': obj.cpuCapacity,
-                'cpuAllocatable': obj.cpuAllocatable,
-                'cpuUsage': obj.cpuUsage,
-                'memCapacity': obj.memCapacity,
-                'memAllocatable': obj.memAllocatable,
-                'memUsage': obj.memUsage,
-                'containerRuntime': obj.containerRuntime,
-                'podsRunning': obj.podsRunning,
-                'podsNotRunning': obj.podsNotRunning
-            }
-        elif isinstance(obj, Pod):
-            return {
-                'id': obj.id,
-                'name': obj.name,
-                'nodeName': obj.nodeName,
-                'phase': obj.phase,
-                'state': obj.state,
-                'cpuUsage': obj.cpuUsage,
-                'memUsage': obj.memUsage
-            }
-        elif isinstance(obj, ResourceUsage):
-            return {
-                'cpuUsage': obj.cpuUsage,
-                'memUsage': obj.memUsage
-            }
+        encoder = _ENCODERS.get(type(obj))
+        if encoder is not None:
+            return encoder(obj)
         return json.JSONEncoder.default(self, obj)
 
 
+# node and pod condition types, in decreasing order of precedence; interned so
+# lookups against freshly parsed condition strings take the identity fast path
+_NODE_STATES = tuple(map(sys.intern, ('Ready', 'KernelDeadlock', 'NetworkUnavailable', 'OutOfDisk', 'MemoryPressure', 'DiskPressure')))
+_POD_STATES = tuple(map(sys.intern, ('Ready', 'ContainersReady', 'PodScheduled', 'Initialized')))
+
+# memory and cpu unit multipliers, resolved with a single dict lookup per value
+_MEM_MULT = {'Ki': 1e3, 'Mi': 1e6, 'Gi': 1e9, 'Ti': 1e12, 'Pi': 1e15, 'Ei': 1e18}
+_CPU_MULT = {'n': 1e-9, 'u': 1e-6, 'm': 1e-3}
+
+
+def decode_memory_capacity(cap_input):
+    if cap_input.endswith('i'):
+        return _MEM_MULT.get(cap_input[-2:], 0) * int(cap_input[:-2])
+    return int(cap_input)
+
+
+def decode_cpu_capacity(cap_input):
+    mult = _CPU_MULT.get(cap_input[-1:])
+    if mult is not None:
+        return mult * int(cap_input[:-1])
+    return int(cap_input)
+
+
 class K8sUsage:
+    __slots__ = ('nodes', 'pods', 'nsResUsage', 'popupContent', 'nodeHtmlList', 'cpuUsedByPods',
+                 'memUsedByPods', 'cpuCapacity', 'memCapacity', 'cpuAllocatable', 'memAllocatable')
+
     def __init__(self):
         self.nodes = {}
         self.pods = {}
@@ -238,92 +299,33 @@ class K8sUsage:
         self.cpuAllocatable = 0.0
         self.memAllocatable = 0.0
 
-    def decode_memory_capacity(self, cap_input):
-        data_length = len(cap_input)
-        cap_unit = ''
-        cap_value = ''
-        if cap_input.endswith("i"):
-            cap_unit = cap_input[data_length - 2:]
-            cap_value = cap_input[0:data_length - 2]
-        else:
-            cap_value = cap_input
-
-        if cap_unit == '':
-            return int(cap_value)
-        if cap_unit == 'Ki':
-            return 1e3 * int(cap_value)
-        if cap_unit == 'Mi':
-            return 1e6 * int(cap_value)
-        if cap_unit == 'Gi':
-            return 1e9 * int(cap_value)
-        if cap_unit == 'Ti':
-            return 1e12 * int(cap_value)
-        if cap_unit == 'Pi':
-            return 1e15 * int(cap_value)
-        if cap_unit == 'Ei':
-            return 1e18 * int(cap_value)
-
-        return 0
-
-    def decode_cpu_capacity(self, cap_input):
-        data_length = len(cap_input)
-        cap_unit = cap_input[data_length - 1:]
-        cap_value = cap_input[0:data_length - 1]
-        if cap_unit == 'n':
-            return 1e-9 * int(cap_value)
-        if cap_unit == 'u':
-            return 1e-6 * int(cap_value)
-        if cap_unit == 'm':
-            return 1e-3 * int(cap_value)
-        return int(cap_input)
-
-    def extract_namespaces_and_initialize_usage(self, data):
-        # exit if not valid data
-        if data is None:
-            return
-        # process likely valid data
-        data_json = json.loads(data)
-        for _, item in enumerate(data_json['items']):
+    decode_memory_capacity = staticmethod(decode_memory_capacity)
+    decode_cpu_capacity = staticmethod(decode_cpu_capacity)
+
+    def extract_namespaces_and_initialize_usage(self, items):
+        for item in items:
             self.nsResUsage[item['metadata']['name']] = ResourceUsage(
                 cpuUsage=0.0, memUsage=0.0)
 
-    def extract_nodes(self, data):
-        # exit if not valid data
-        if data is None:
-            return
-        # process likely valid data
-        data_json = json.loads(data)
-        for _, item in enumerate(data_json['items']):
+    def extract_nodes(self, items):
+        for item in items:
             node = Node()
             node.podsRunning = []
             node.podsNotRunning = []
             node.name = item['metadata']['name']
             node.id = item['metadata']['uid']
-            node.cpuCapacity = self.decode_cpu_capacity(item['status']['capacity']['cpu'])
-            node.cpuAllocatable = self.decode_cpu_capacity(item['status']['allocatable']['cpu'])
-            node.memCapacity = self.decode_memory_capacity(item['status']['capacity']['memory'])
-            node.memAllocatable = self.decode_memory_capacity(item['status']['allocatable']['memory'])
+            node.cpuCapacity = decode_cpu_capacity(item['status']['capacity']['cpu'])
+            node.cpuAllocatable = decode_cpu_capacity(item['status']['allocatable']['cpu'])
+            node.memCapacity = decode_memory_capacity(item['status']['capacity']['memory'])
+            node.memAllocatable = decode_memory_capacity(item['status']['allocatable']['memory'])
             node.containerRuntime = item['status']['nodeInfo']['containerRuntimeVersion']
 
-            for _, cond in enumerate(item['status']['conditions']):
-                node.message = cond['message']
-                if cond['type'] == 'Ready' and cond['status'] == 'True':
-                    node.state = 'Ready'
-                    break
-                if cond['type'] == 'KernelDeadlock' and cond['status'] == 'True':
-                    node.state = 'KernelDeadlock'
-                    break
-                if cond['type'] == 'NetworkUnavailable' and cond['status'] == 'True':
-                    node.state = 'NetworkUnavailable'
-                    break
-                if cond['type'] == 'OutOfDisk' and cond['status'] == 'True':
-                    node.state = 'OutOfDisk'
-                    break
-                if cond['type'] == 'MemoryPressure' and cond['status'] == 'True':
-                    node.state = 'MemoryPressure'
-                    break
-                if cond['type'] == 'DiskPressure' and cond['status'] == 'True':
-                    node.state = 'DiskPressure'
+            conds = {sys.intern(cond['type']): cond for cond in item['status']['conditions']}
+            for state in _NODE_STATES:
+                cond = conds.get(state)
+                if cond is not None and sys.intern(cond['status']) == 'True':
+                    node.state = state
+                    node.message = cond['message']
                     break
             self.nodes[node.name] = node
 
@@ -332,22 +334,17 @@ class K8sUsage:
         if data is None:
             return
         # process likely valid data
-        data_json = json.loads(data)
-        for _, item in enumerate(data_json['items']):
-            node = self.nodes.get(item['metadata']['name'], None)
-            if node is not None:
-                node.cpuUsage = self.decode_cpu_capacity(item['usage']['cpu'])
-                node.memUsage = self.decode_memory_capacity(item['usage']['memory'])
-                self.nodes[node.name] = node
-
-    def extract_pods(self, data):
-        # exit if not valid data
-        if data is None:
-            return
-
-        # process likely valid data
-        data_json = json.loads(data)
-        for _, item in enumerate(data_json['items']):
+        data_json = orjson.loads(data)
+        for item in data_json['items']:
+            try:
+                node = self.nodes[item['metadata']['name']]
+            except KeyError:
+                continue
+            node.cpuUsage = decode_cpu_capacity(item['usage']['cpu'])
+            node.memUsage = decode_memory_capacity(item['usage']['memory'])
+
+    def extract_pods(self, items):
+        for item in items:
             pod = Pod()
             pod.namespace = item['metadata']['namespace']
             pod.name = '%s.%s' % (item['metadata']['name'], pod.namespace)
@@ -357,19 +354,12 @@ class K8sUsage:
                 KOA_LOGGER.debug('[puller] phase of pod %s in namespace %s is %s'%(pod.name, pod.namespace, pod.phase))
             else:
                 pod.state = 'PodNotScheduled'
-                for _, cond in enumerate(item['status']['conditions']):
-                    if cond['type'] == 'Ready' and cond['status'] == 'True':
-                        pod.state = 'Ready'
-                        break
-                    if cond['type'] == 'ContainersReady' and cond['status'] == 'True':
-                        pod.state = "ContainersReady"
+                conds = {sys.intern(cond['type']): cond for cond in item['status']['conditions']}
+                for state in _POD_STATES:
+                    cond = conds.get(state)
+                    if cond is not None and sys.intern(cond['status']) == 'True':
+                        pod.state = state
                         break
-                    if cond['type'] == 'PodScheduled' and cond['status'] == 'True':
-                        pod.state = "PodScheduled"
-                        break
-                    if cond['type'] == 'Initialized' and cond['status'] == 'True':
-                        pod.state = "Initialized"
-                        break                
 
             if pod.state != 'PodNotScheduled':
                 pod.nodeName = item['spec']['nodeName']
@@ -383,45 +373,65 @@ class K8sUsage:
         if data is None:
             return
         # process likely valid data
-        data_json = json.loads(data)
-        for _, item in enumerate(data_json['items']):
+        # stream the items one at a time: this is the largest per-cycle payload and
+        # materializing its full object graph at once is pure transient memory
+        for item in ijson.items(data, 'items.item'):
             podName = '%s.%s' % (item['metadata']['name'], item['metadata']['namespace'])
-            pod = self.pods.get(podName, None)
-            if pod is not None:
-                pod.cpuUsage = 0.0
-                pod.memUsage = 0.0
-                for _, container in enumerate(item['containers']):
-                    pod.cpuUsage += self.decode_cpu_capacity(container['usage']['cpu'])
-                    pod.memUsage += self.decode_memory_capacity(container['usage']['memory'])
-                self.pods[pod.name] = pod
+            try:
+                pod = self.pods[podName]
+            except KeyError:
+                continue
+            pod.cpuUsage = 0.0
+            pod.memUsage = 0.0
+            for container in item['containers']:
+                pod.cpuUsage += decode_cpu_capacity(container['usage']['cpu'])
+                pod.memUsage += decode_memory_capacity(container['usage']['memory'])
 
 
     def consolidate_ns_usage(self):
-        self.cpuUsedByPods = 0.0
-        self.memUsedByPods = 0.0
+        # one pass over the pods to collect SoA arrays, then reduce per namespace in C
+        ns_index = {ns: i for i, ns in enumerate(self.nsResUsage)}
+        pod_ns_ids = []
+        pod_cpu = []
+        pod_mem = []
         for pod in self.pods.values():
-            if hasattr(pod, 'cpuUsage') and hasattr(pod, 'memUsage'):
-                self.cpuUsedByPods += pod.cpuUsage
-                self.nsResUsage[pod.namespace].cpuUsage += pod.cpuUsage
-                self.nsResUsage[pod.namespace].memUsage += pod.memUsage
-                self.memUsedByPods += pod.memUsage
-                self.nodes[pod.nodeName].podsRunning.append(pod)
-        self.cpuCapacity += 0.0
-        self.memCapacity += 0.0
+            if pod.nodeName is None or pod.nodeName not in self.nodes:
+                continue
+            pod_ns_ids.append(ns_index[pod.namespace])
+            pod_cpu.append(pod.cpuUsage)
+            pod_mem.append(pod.memUsage)
+            self.nodes[pod.nodeName].podsRunning.append(pod)
+        cpu = numpy.asarray(pod_cpu, dtype=numpy.float64)
+        mem = numpy.asarray(pod_mem, dtype=numpy.float64)
+        ns_ids = numpy.asarray(pod_ns_ids, dtype=numpy.intp)
+        self.cpuUsedByPods = float(cpu.sum())
+        self.memUsedByPods = float(mem.sum())
+        cpu_sums = numpy.bincount(ns_ids, weights=cpu, minlength=len(ns_index))
+        mem_sums = numpy.bincount(ns_ids, weights=mem, minlength=len(ns_index))
+        for ns, i in ns_index.items():
+            nsUsage = self.nsResUsage[ns]
+            nsUsage.cpuUsage += float(cpu_sums[i])
+            nsUsage.memUsage += float(mem_sums[i])
         for node in self.nodes.values():
-            if hasattr(node, 'cpuCapacity') and hasattr(node, 'memCapacity'):
-                self.cpuCapacity += node.cpuCapacity
-                self.memCapacity += node.memCapacity
-        self.cpuAllocatable += 0.0
-        self.memAllocatable += 0.0
-        for node in self.nodes.values():
-            if hasattr(node, 'cpuAllocatable') and hasattr(node, 'memAllocatable'):
-                self.cpuAllocatable += node.cpuAllocatable
-                self.memAllocatable += node.memAllocatable
+            self.cpuCapacity += node.cpuCapacity
+            self.memCapacity += node.memCapacity
+            self.cpuAllocatable += node.cpuAllocatable
+            self.memAllocatable += node.memAllocatable
 
     def dump_nodes(self):
-        with open(str('%s/nodes.json' % KOA_CONFIG.frontend_data_location), 'w') as fd:
-            fd.write(json.dumps(self.nodes, cls=JSONMarshaller))
+        with open(str('%s/nodes.json' % KOA_CONFIG.frontend_data_location), 'wb') as fd:
+            fd.write(orjson.dumps(self.nodes, default=_encode_k8s_object))
+
+@numba.njit(cache=True)
+def _bucket_sum(cpu_usage, mem_usage, bucket_ids, n_buckets):
+    # numba prefers explicit loops over numpy.add.at, and compiles them to native code
+    cpu_sums = numpy.zeros(n_buckets, dtype=numpy.float64)
+    mem_sums = numpy.zeros(n_buckets, dtype=numpy.float64)
+    for i in range(bucket_ids.shape[0]):
+        cpu_sums[bucket_ids[i]] += cpu_usage[i]
+        mem_sums[bucket_ids[i]] += mem_usage[i]
+    return cpu_sums, mem_sums
+
 
 def compute_usage_percent_ratio(value, total):
     return round((100.0*value) / total, KOA_CONFIG.db_round_decimals) 
@@ -431,9 +441,16 @@ class ResUsageType(enum.IntEnum):
     MEMORY              = 1
 
 
+# bounded pool for per-database analytics dumps; rrdtool releases the GIL on fetch
+# and the cap keeps the underlying I/O from being overloaded
+_EXPORT_POOL = concurrent.futures.ThreadPoolExecutor(max_workers=min(8, (os.cpu_count() or 4)))
+
+
 class Rrd:
-    def __init__(self, db_files_location=None, dbname=None):
-        create_directory_if_not_exists(db_files_location)
+    # rrd paths already known to exist, to skip the stat syscall on later instantiations
+    _EXISTS_CACHE = set()
+
+    def __init__(self, dbname=None):
         self.dbname = dbname
         self.rrd_location = str('%s/%s' % (KOA_CONFIG.db_location, dbname))
         self.create_rrd_file_if_not_exists()
@@ -448,65 +465,83 @@ class Rrd:
         return time.strftime('%d %b', timeUTC)
 
     def create_rrd_file_if_not_exists(self):
+        if self.rrd_location in Rrd._EXISTS_CACHE:
+            return
         if not os.path.exists(self.rrd_location):
             xfs = 2 * KOA_CONFIG.polling_interval_sec
-            rrdtool.create(self.rrd_location,
+            create_args = [
                 "--step", str(KOA_CONFIG.polling_interval_sec),
                 "--start", "0",
                 str('DS:cpu_usage:GAUGE:%d:U:U' % xfs),
                 str('DS:mem_usage:GAUGE:%d:U:U' % xfs),
                 "RRA:AVERAGE:0.5:1:4032",
-                "RRA:AVERAGE:0.5:12:8880")
-
-    def add_sample(self, timestamp_epoch, cpu_usage, mem_usage):
-        KOA_LOGGER.debug('[puller][sample] %s, %f, %f' % (self.dbname, cpu_usage, mem_usage))
-        try:
-            rrdtool.update(self.rrd_location, '%s:%s:%s'%(
-                timestamp_epoch, 
-                round(cpu_usage, KOA_CONFIG.db_round_decimals), 
+                "RRA:AVERAGE:0.5:12:8880"]
+            if KOA_CONFIG.rrdcached_socket:
+                create_args = ['--daemon', KOA_CONFIG.rrdcached_socket] + create_args
+            rrdtool.create(self.rrd_location, *create_args)
+        Rrd._EXISTS_CACHE.add(self.rrd_location)
+
+    def add_sample(self, samples):
+        update_args = []
+        for timestamp_epoch, cpu_usage, mem_usage in samples:
+            KOA_LOGGER.debug('[puller][sample] %s, %f, %f' % (self.dbname, cpu_usage, mem_usage))
+            update_args.append('%s:%s:%s'%(
+                timestamp_epoch,
+                round(cpu_usage, KOA_CONFIG.db_round_decimals),
                 round(mem_usage, KOA_CONFIG.db_round_decimals)))
+        if not update_args:
+            return
+        if KOA_CONFIG.rrdcached_socket:
+            update_args = ['--daemon', KOA_CONFIG.rrdcached_socket] + update_args
+        try:
+            rrdtool.update(self.rrd_location, *update_args)
         except rrdtool.OperationalError as e:
             KOA_LOGGER.error("failing adding rrd sample (%s)" % e)
 
 
     def dump_trend_data(self, period, step_in=None):
-        now_epoch_utc = calendar.timegm(time.gmtime())
+        now_epoch_utc = int(time.time())
         if step_in is not None:
             step = int(step_in)
-        else: 
+        else:
             step = int(RrdPeriod.PERIOD_1_HOUR_SEC)
 
-        rrd_end_ts_in = int(int(calendar.timegm(time.gmtime()) * step) / step)
-        rrd_start_ts_in  = int(rrd_end_ts_in - int(period))
-        rrd_result = rrdtool.fetch(self.rrd_location, 'AVERAGE', '-r', str(step), '-s', str(rrd_start_ts_in), '-e', str(rrd_end_ts_in))
+        current_hour_ts = (now_epoch_utc // int(RrdPeriod.PERIOD_1_HOUR_SEC)) * int(RrdPeriod.PERIOD_1_HOUR_SEC)
+        rrd_end_ts_in = (now_epoch_utc // step) * step
+        rrd_start_ts_in = rrd_end_ts_in - int(period)
+        fetch_args = ['AVERAGE', '-r', str(step), '-s', str(rrd_start_ts_in), '-e', str(rrd_end_ts_in)]
+        if KOA_CONFIG.rrdcached_socket:
+            # make the daemon flush its buffered samples before reading the file
+            fetch_args += ['--daemon', KOA_CONFIG.rrdcached_socket]
+        rrd_result = rrdtool.fetch(self.rrd_location, *fetch_args)
         rrd_start_ts_out, _, step = rrd_result[0]
         rrd_current_ts = rrd_start_ts_out
         res_usage = collections.defaultdict(list)
         sum_res_usage = collections.defaultdict(lambda:0.0)
-        for _, cdp in enumerate( rrd_result[2] ):
+        for cdp in rrd_result[2]:
             rrd_current_ts += step
-            if len(cdp) == 2:
-                try:
-                    rrd_cdp_gmtime = time.gmtime(rrd_current_ts)
-                    current_cpu_usage = round(100*float(cdp[0]), KOA_CONFIG.db_round_decimals)/100
-                    current_mem_usage = round(100*float(cdp[1]), KOA_CONFIG.db_round_decimals)/100
-                    datetime_utc_json = time.strftime('%Y-%m-%dT%H:%M:%SZ', rrd_cdp_gmtime)
-                    res_usage[ResUsageType.CPU].append('{"name":"%s","dateUTC":"%s","usage":%f}' % (self.dbname, datetime_utc_json, current_cpu_usage))
-                    res_usage[ResUsageType.MEMORY].append('{"name":"%s","dateUTC":"%s","usage":%f}' % (self.dbname, datetime_utc_json, current_mem_usage))
-                    sum_res_usage[ResUsageType.CPU] += current_cpu_usage
-                    sum_res_usage[ResUsageType.MEMORY] += current_mem_usage
-                    if calendar.timegm(rrd_cdp_gmtime) == int(int(now_epoch_utc / RrdPeriod.PERIOD_1_HOUR_SEC) * RrdPeriod.PERIOD_1_HOUR_SEC):
-                        PROMETHEUS_HOURLY_USAGE_EXPORTER.labels(self.dbname, ResUsageType.CPU.name).set(current_cpu_usage)
-                        PROMETHEUS_HOURLY_USAGE_EXPORTER.labels(self.dbname, ResUsageType.MEMORY.name).set(current_mem_usage)                    
-                except:
-                    pass
+            # rrdtool yields None for missing samples, filter them with a branch
+            # instead of paying for an exception per point
+            if len(cdp) != 2 or cdp[0] is None or cdp[1] is None:
+                continue
+            rrd_cdp_gmtime = time.gmtime(rrd_current_ts)
+            current_cpu_usage = round(100*float(cdp[0]), KOA_CONFIG.db_round_decimals)/100
+            current_mem_usage = round(100*float(cdp[1]), KOA_CONFIG.db_round_decimals)/100
+            datetime_utc_json = time.strftime('%Y-%m-%dT%H:%M:%SZ', rrd_cdp_gmtime)
+            res_usage[ResUsageType.CPU].append({'name': self.dbname, 'dateUTC': datetime_utc_json, 'usage': current_cpu_usage})
+            res_usage[ResUsageType.MEMORY].append({'name': self.dbname, 'dateUTC': datetime_utc_json, 'usage': current_mem_usage})
+            sum_res_usage[ResUsageType.CPU] += current_cpu_usage
+            sum_res_usage[ResUsageType.MEMORY] += current_mem_usage
+            if rrd_current_ts == current_hour_ts:
+                PROMETHEUS_HOURLY_USAGE_EXPORTER.labels(self.dbname, ResUsageType.CPU.name).set(current_cpu_usage)
+                PROMETHEUS_HOURLY_USAGE_EXPORTER.labels(self.dbname, ResUsageType.MEMORY.name).set(current_mem_usage)
 
         if sum_res_usage[ResUsageType.CPU] > 0.0 and sum_res_usage[ResUsageType.MEMORY] > 0.0:
-            return (','.join(res_usage[ResUsageType.CPU]), ','.join(res_usage[ResUsageType.MEMORY]))
+            return (res_usage[ResUsageType.CPU], res_usage[ResUsageType.MEMORY])
         else:
             if step_in is None:
                 return self.dump_trend_data(period, step_in=RrdPeriod.PERIOD_5_MINS_SEC)
-        return '', ''
+        return [], []
 
 
     def dump_histogram_data(self, period, step_in=None):
@@ -515,54 +550,62 @@ class Rrd:
         else: 
             step = int(RrdPeriod.PERIOD_1_HOUR_SEC)
 
-        rrd_end_ts = int(int(calendar.timegm(time.gmtime()) * step) / step)
-        rrd_start_ts  = int(rrd_end_ts - int(period))
-        rrd_result = rrdtool.fetch(self.rrd_location, 'AVERAGE', '-r', str(step), '-s', str(rrd_start_ts), '-e', str(rrd_end_ts))
+        now_epoch_utc = int(time.time())
+        rrd_end_ts = (now_epoch_utc // step) * step
+        rrd_start_ts = rrd_end_ts - int(period)
+        fetch_args = ['AVERAGE', '-r', str(step), '-s', str(rrd_start_ts), '-e', str(rrd_end_ts)]
+        if KOA_CONFIG.rrdcached_socket:
+            # make the daemon flush its buffered samples before reading the file
+            fetch_args += ['--daemon', KOA_CONFIG.rrdcached_socket]
+        rrd_result = rrdtool.fetch(self.rrd_location, *fetch_args)
         rrd_start_ts_out, _, step = rrd_result[0]
-        rrd_current_ts = rrd_start_ts_out
         periodic_cpu_usage = collections.defaultdict(lambda:0.0)
         periodic_mem_usage = collections.defaultdict(lambda:0.0)
-        for _, cdp in enumerate( rrd_result[2] ):
-            rrd_current_ts += step
-            if len(cdp) == 2:
-                try:
-                    rrd_cdp_gmtime = time.gmtime(rrd_current_ts)
-                    date_group = self.get_date_group(rrd_cdp_gmtime, period)
-                    current_cpu_usage = round(100*float(cdp[0]), KOA_CONFIG.db_round_decimals)/100
-                    current_mem_usage = round(100*float(cdp[1]), KOA_CONFIG.db_round_decimals)/100
-                    periodic_cpu_usage[date_group] += current_cpu_usage
-                    periodic_mem_usage[date_group] += current_mem_usage
-                except:
-                    pass
+        cdps = numpy.array(rrd_result[2], dtype=numpy.float64)
+        if cdps.size == 0:
+            return periodic_cpu_usage, periodic_mem_usage
+        timestamps = rrd_start_ts_out + step * numpy.arange(1, cdps.shape[0] + 1)
+        valid = ~numpy.isnan(cdps).any(axis=1)
+        cpu_usage = numpy.round(100 * cdps[valid, 0], KOA_CONFIG.db_round_decimals) / 100
+        mem_usage = numpy.round(100 * cdps[valid, 1], KOA_CONFIG.db_round_decimals) / 100
+        day_ids = timestamps[valid] // int(RrdPeriod.PERIOD_1_DAY_SEC)
+        unique_days, bucket_ids = numpy.unique(day_ids, return_inverse=True)
+        cpu_sums, mem_sums = _bucket_sum(numpy.ascontiguousarray(cpu_usage),
+                                         numpy.ascontiguousarray(mem_usage),
+                                         bucket_ids, unique_days.shape[0])
+        # strftime stays on the Python side and runs once per calendar bucket
+        for i, day_id in enumerate(unique_days):
+            date_group = self.get_date_group(time.gmtime(day_id * int(RrdPeriod.PERIOD_1_DAY_SEC)), period)
+            periodic_cpu_usage[date_group] += float(cpu_sums[i])
+            periodic_mem_usage[date_group] += float(mem_sums[i])
         return periodic_cpu_usage, periodic_mem_usage
 
     @staticmethod
-    def dump_trend_analytics(dbfiles):
+    def dump_trend_analytics(rrds):
         res_usage = collections.defaultdict(list)
-        for _, db in enumerate(dbfiles):
-            if db == KOA_CONFIG.db_billing_hourly_rate:
-                if not KOA_CONFIG.enable_debug: 
-                    continue
-            rrd = Rrd(db_files_location=KOA_CONFIG.db_location, dbname=db)
-            current_trend_data = rrd.dump_trend_data(period=RrdPeriod.PERIOD_7_DAYS_SEC)
+        exportable = [rrd for db, rrd in rrds.items()
+                      if db != KOA_CONFIG.db_billing_hourly_rate or KOA_CONFIG.enable_debug]
+        for current_trend_data in _EXPORT_POOL.map(
+                lambda rrd: rrd.dump_trend_data(period=RrdPeriod.PERIOD_7_DAYS_SEC), exportable):
             for res in [ResUsageType.CPU, ResUsageType.MEMORY]:
                 if current_trend_data[res]:
-                    res_usage[res].append(current_trend_data[res])
+                    res_usage[res].extend(current_trend_data[res])
 
-        with open(str('%s/cpu_usage_trends.json' % KOA_CONFIG.frontend_data_location), 'w') as fd:
-            fd.write('['+','.join(res_usage[0])+']')
-        with open(str('%s/memory_usage_trends.json' % KOA_CONFIG.frontend_data_location), 'w') as fd:
-            fd.write('['+','.join(res_usage[1])+']')
+        with open(str('%s/cpu_usage_trends.json' % KOA_CONFIG.frontend_data_location), 'wb') as fd:
+            fd.write(orjson.dumps(res_usage[0]))
+        with open(str('%s/memory_usage_trends.json' % KOA_CONFIG.frontend_data_location), 'wb') as fd:
+            fd.write(orjson.dumps(res_usage[1]))
 
     @staticmethod
-    def dump_histogram_analytics(dbfiles, period):
+    def dump_histogram_analytics(rrds, period):
         now_gmtime = time.gmtime()
         usage_export = collections.defaultdict(list)
         usage_per_type_date = {}
         sum_usage_per_type_date = {}
-        for _, db in enumerate(dbfiles):
-            rrd = Rrd(db_files_location=KOA_CONFIG.db_location, dbname=db)
-            current_periodic_usage = rrd.dump_histogram_data(period=period)  
+        # fetch every database concurrently, then merge the results serially
+        periodic_usage_per_db = zip(rrds.keys(), _EXPORT_POOL.map(
+            lambda rrd: rrd.dump_histogram_data(period=period), rrds.values()))
+        for db, current_periodic_usage in periodic_usage_per_db:
             for res in [ResUsageType.CPU, ResUsageType.MEMORY]:
                 for date_key, usage_value in current_periodic_usage[res].items():
                     if usage_value > 0.0:
@@ -587,83 +630,197 @@ class Rrd:
                             usage_cost = round(100 * usage_ratio, KOA_CONFIG.db_round_decimals)
                             if KOA_CONFIG.cost_model == 'CHARGE_BACK':
                                 usage_cost = round(usage_ratio * usage_per_type_date[res][date_key][KOA_CONFIG.db_billing_hourly_rate], KOA_CONFIG.db_round_decimals)     
-                        usage_export[res].append('{"stack":"%s","usage":%f,"date":"%s"}' % (db, usage_cost, date_key))
+                        usage_export[res].append({'stack': db, 'usage': usage_cost, 'date': date_key})
                         if Rrd.get_date_group(now_gmtime, period) == date_key:
                             PROMETHEUS_PERIODIC_USAGE_EXPORTERS[period].labels(db, ResUsageType(res).name).set(usage_cost)
 
-        with open(str('%s/cpu_usage_period_%d.json' % (KOA_CONFIG.frontend_data_location, period)), 'w') as fd:
-            fd.write('['+','.join(usage_export[0])+']')
-        with open(str('%s/memory_usage_period_%d.json' % (KOA_CONFIG.frontend_data_location, period)), 'w') as fd:
-            fd.write('['+','.join(usage_export[1])+']')
+        with open(str('%s/cpu_usage_period_%d.json' % (KOA_CONFIG.frontend_data_location, period)), 'wb') as fd:
+            fd.write(orjson.dumps(usage_export[0]))
+        with open(str('%s/memory_usage_period_%d.json' % (KOA_CONFIG.frontend_data_location, period)), 'wb') as fd:
+            fd.write(orjson.dumps(usage_export[1]))
 
 
-def pull_k8s(api_context):
-    data = None
-    api_endpoint = '%s%s' % (KOA_CONFIG.k8s_api_endpoint, api_context)
-    headers = {}
+@functools.lru_cache(maxsize=4096)
+def get_rrd(dbname):
+    return Rrd(dbname=dbname)
 
+
+def k8s_auth_headers():
+    headers = {}
     if KOA_CONFIG.enable_debug:
         headers['Authorization'] = ('Bearer %s' % KOA_CONFIG.k8s_debug_auth_token)
     else:
         headers['Authorization'] = ('Bearer %s' % KOA_CONFIG.k8s_rbac_auth_token)
+    return headers
+
+
+async def pull_k8s(session, api_context):
+    data = None
+    api_endpoint = '%s%s' % (KOA_CONFIG.k8s_api_endpoint, api_context)
 
     try:
-        http_req = requests.get(api_endpoint, verify=KOA_CONFIG.k8s_verify_ssl, headers=headers)
-        if http_req.status_code == 200:
-            data = http_req.text
-        else:
-            KOA_LOGGER.error("call to %s returned error (%s)" % (api_endpoint, http_req.text))
-    except requests.exceptions.RequestException as ex:
+        async with session.get(api_endpoint, timeout=aiohttp.ClientTimeout(sock_connect=3, sock_read=30)) as http_req:
+            if http_req.status == 200:
+                data = await http_req.read()
+            else:
+                KOA_LOGGER.error("call to %s returned error (%s)" % (api_endpoint, await http_req.text()))
+    except aiohttp.ClientError as ex:
         KOA_LOGGER.error("HTTP exception requesting %s (%s)" % (api_endpoint, ex))
-    except:
-        KOA_LOGGER.error("unknown exception requesting %s" % api_endpoint)
+    except Exception as ex:
+        KOA_LOGGER.error("unexpected exception requesting %s (%s)" % (api_endpoint, ex))
 
     return data
 
 
+class K8sReflector:
+    """maintains in-memory caches of namespaces, nodes and pods updated by watch streams,
+    so per-cycle snapshots are local dict reads instead of full LIST calls"""
+
+    def __init__(self):
+        self.namespaces = {}
+        self.nodes = {}
+        self.pods = {}
+
+    def snapshot_namespaces(self):
+        return list(self.namespaces.values())
+
+    def snapshot_nodes(self):
+        return list(self.nodes.values())
+
+    def snapshot_pods(self):
+        return list(self.pods.values())
+
+    async def watch(self, session, api_context, cache):
+        api_endpoint = '%s%s' % (KOA_CONFIG.k8s_api_endpoint, api_context)
+        while True:
+            try:
+                # initial LIST to seed the cache and get a resource version to watch from
+                data = await pull_k8s(session, api_context)
+                if data is None:
+                    await asyncio.sleep(int(KOA_CONFIG.polling_interval_sec))
+                    continue
+                data_json = orjson.loads(data)
+                cache.clear()
+                for item in data_json['items']:
+                    cache[item['metadata']['uid']] = item
+                resource_version = data_json['metadata']['resourceVersion']
+                async with session.get('%s?watch=true&resourceVersion=%s' % (api_endpoint, resource_version),
+                                       timeout=aiohttp.ClientTimeout(total=None)) as http_req:
+                    if http_req.status != 200:
+                        KOA_LOGGER.error("watch on %s returned error (%s)" % (api_endpoint, await http_req.text()))
+                        await asyncio.sleep(int(KOA_CONFIG.polling_interval_sec))
+                        continue
+                    async for line in http_req.content:
+                        if not line.strip():
+                            continue
+                        event = orjson.loads(line)
+                        if event['type'] == 'ERROR':
+                            break
+                        item = event['object']
+                        if event['type'] == 'DELETED':
+                            cache.pop(item['metadata']['uid'], None)
+                        else:
+                            cache[item['metadata']['uid']] = item
+            except aiohttp.ClientError as ex:
+                KOA_LOGGER.error("HTTP exception watching %s (%s)" % (api_endpoint, ex))
+                await asyncio.sleep(int(KOA_CONFIG.polling_interval_sec))
+            except Exception as ex:
+                # not a bare except: cancellation must still tear the task down
+                KOA_LOGGER.error("unexpected exception watching %s (%s)" % (api_endpoint, ex))
+                await asyncio.sleep(int(KOA_CONFIG.polling_interval_sec))
+
+
 def create_metrics_puller():
-    while True:
-        k8s_usage = K8sUsage()
-        KOA_LOGGER.debug('{puller] collecting new metrics')
-        k8s_usage.extract_namespaces_and_initialize_usage( pull_k8s('/api/v1/namespaces') )
-        k8s_usage.extract_nodes( pull_k8s('/api/v1/nodes') )
-        k8s_usage.extract_node_metrics( pull_k8s('/apis/metrics.k8s.io/v1beta1/nodes') )
-        k8s_usage.extract_pods( pull_k8s('/api/v1/pods') )
-        k8s_usage.extract_pod_metrics( pull_k8s('/apis/metrics.k8s.io/v1beta1/pods') )
-        k8s_usage.consolidate_ns_usage()
-        k8s_usage.dump_nodes()
-        if k8s_usage.cpuCapacity > 0.0 and k8s_usage.memCapacity > 0.0:
-            now_epoch = calendar.timegm(time.gmtime())
-            # add non-allocatable resources
-            rrd = Rrd(db_files_location=KOA_CONFIG.db_location, dbname=KOA_CONFIG.db_non_allocatable)
-            cpu_usage = compute_usage_percent_ratio(k8s_usage.cpuCapacity - k8s_usage.cpuAllocatable, k8s_usage.cpuCapacity)
-            mem_usage = compute_usage_percent_ratio(k8s_usage.memCapacity - k8s_usage.memAllocatable, k8s_usage.memCapacity)
-            rrd.add_sample(timestamp_epoch=now_epoch, cpu_usage=cpu_usage, mem_usage=mem_usage)
-            # handle billing data
-            rrd = Rrd(db_files_location=KOA_CONFIG.db_location, dbname=KOA_CONFIG.db_billing_hourly_rate)
-            cpu_usage = compute_usage_percent_ratio(k8s_usage.cpuCapacity - k8s_usage.cpuAllocatable, k8s_usage.cpuCapacity)
-            mem_usage = compute_usage_percent_ratio(k8s_usage.memCapacity - k8s_usage.memAllocatable, k8s_usage.memCapacity)
-            rrd.add_sample(timestamp_epoch=now_epoch, cpu_usage=KOA_CONFIG.billing_hourly_rate, mem_usage=KOA_CONFIG.billing_hourly_rate)
-
-            for ns, nsUsage in k8s_usage.nsResUsage.items():
-                rrd = Rrd(db_files_location=KOA_CONFIG.db_location, dbname=ns)
-                cpu_usage = compute_usage_percent_ratio(nsUsage.cpuUsage, k8s_usage.cpuCapacity)
-                mem_usage = compute_usage_percent_ratio(nsUsage.memUsage, k8s_usage.memCapacity)
-                rrd.add_sample(timestamp_epoch=now_epoch, cpu_usage=cpu_usage, mem_usage=mem_usage)
-        time.sleep(int(KOA_CONFIG.polling_interval_sec))
+    async def main():
+        reflector = K8sReflector()
+        # one session for the whole process lifetime: connections (and TLS handshakes)
+        # are established once and kept alive across polling cycles; the enlarged read
+        # buffer keeps single watch lines carrying large objects under the readline limit
+        connector = aiohttp.TCPConnector(limit=8, ssl=KOA_CONFIG.k8s_verify_ssl)
+        async with aiohttp.ClientSession(connector=connector, headers=k8s_auth_headers(),
+                                         read_bufsize=2**22) as session:
+            watched_resources = (
+                ('/api/v1/namespaces', reflector.namespaces),
+                ('/api/v1/nodes', reflector.nodes),
+                ('/api/v1/pods', reflector.pods))
+            watch_tasks = {api_context: asyncio.ensure_future(reflector.watch(session, api_context, cache))
+                           for api_context, cache in watched_resources}
+            # give the watches a chance to complete their initial LIST before the first cycle
+            await asyncio.sleep(5)
+            # schedule cycles against monotonic deadlines so a slow cycle does not
+            # shift every subsequent sample off the RRD step grid
+            next_cycle_ts = time.monotonic()
+            while True:
+                # restart any watch task that died, otherwise the caches freeze silently
+                for api_context, cache in watched_resources:
+                    task = watch_tasks[api_context]
+                    if task.done():
+                        reason = 'cancelled' if task.cancelled() else task.exception()
+                        KOA_LOGGER.error("watch task on %s died (%s), restarting" % (api_context, reason))
+                        watch_tasks[api_context] = asyncio.ensure_future(reflector.watch(session, api_context, cache))
+                k8s_usage = K8sUsage()
+                KOA_LOGGER.debug('{puller] collecting new metrics')
+                # only the metrics endpoints need polling, cluster objects come from the reflector
+                node_metrics, pod_metrics = await asyncio.gather(
+                    pull_k8s(session, '/apis/metrics.k8s.io/v1beta1/nodes'),
+                    pull_k8s(session, '/apis/metrics.k8s.io/v1beta1/pods'))
+                k8s_usage.extract_namespaces_and_initialize_usage(reflector.snapshot_namespaces())
+                k8s_usage.extract_nodes(reflector.snapshot_nodes())
+                k8s_usage.extract_node_metrics(node_metrics)
+                k8s_usage.extract_pods(reflector.snapshot_pods())
+                k8s_usage.extract_pod_metrics(pod_metrics)
+                k8s_usage.consolidate_ns_usage()
+                k8s_usage.dump_nodes()
+                process_usage(k8s_usage)
+                next_cycle_ts += int(KOA_CONFIG.polling_interval_sec)
+                delay = next_cycle_ts - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    KOA_LOGGER.warning('[puller] cycle overran its interval by %.2fs' % -delay)
+                    next_cycle_ts = time.monotonic()
+
+    asyncio.run(main())
+
+
+def process_usage(k8s_usage):
+    if k8s_usage.cpuCapacity > 0.0 and k8s_usage.memCapacity > 0.0:
+        now_epoch = calendar.timegm(time.gmtime())
+        # collect all the cycle's samples, then flush them in a single write loop
+        pending_samples = []
+        # add non-allocatable resources
+        cpu_usage = compute_usage_percent_ratio(k8s_usage.cpuCapacity - k8s_usage.cpuAllocatable, k8s_usage.cpuCapacity)
+        mem_usage = compute_usage_percent_ratio(k8s_usage.memCapacity - k8s_usage.memAllocatable, k8s_usage.memCapacity)
+        pending_samples.append((KOA_CONFIG.db_non_allocatable, cpu_usage, mem_usage))
+        # handle billing data
+        pending_samples.append((KOA_CONFIG.db_billing_hourly_rate, KOA_CONFIG.billing_hourly_rate, KOA_CONFIG.billing_hourly_rate))
+
+        for ns, nsUsage in k8s_usage.nsResUsage.items():
+            cpu_usage = compute_usage_percent_ratio(nsUsage.cpuUsage, k8s_usage.cpuCapacity)
+            mem_usage = compute_usage_percent_ratio(nsUsage.memUsage, k8s_usage.memCapacity)
+            pending_samples.append((ns, cpu_usage, mem_usage))
+
+        for dbname, cpu_usage, mem_usage in pending_samples:
+            rrd = get_rrd(dbname)
+            rrd.add_sample(samples=[(now_epoch, cpu_usage, mem_usage)])
 
 
 def dump_analytics():
     export_interval = round(1.5 * KOA_CONFIG.polling_interval_sec)
+    next_export_ts = time.monotonic()
     while True:
-        dbfiles = []
-        for (_, _, filenames) in os.walk(KOA_CONFIG.db_location):
-            dbfiles.extend(filenames)
-            break
-        Rrd.dump_trend_analytics(dbfiles)
-        Rrd.dump_histogram_analytics(dbfiles=dbfiles, period=RrdPeriod.PERIOD_14_DAYS_SEC)
-        Rrd.dump_histogram_analytics(dbfiles=dbfiles, period=RrdPeriod.PERIOD_YEAR_SEC)
-        time.sleep(export_interval)
+        # snapshot the db files once and reuse the same Rrd handles for the three dumps
+        rrds = {db: get_rrd(db) for db in os.listdir(KOA_CONFIG.db_location)}
+        Rrd.dump_trend_analytics(rrds)
+        Rrd.dump_histogram_analytics(rrds=rrds, period=RrdPeriod.PERIOD_14_DAYS_SEC)
+        Rrd.dump_histogram_analytics(rrds=rrds, period=RrdPeriod.PERIOD_YEAR_SEC)
+        next_export_ts += export_interval
+        delay = next_export_ts - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            KOA_LOGGER.warning('[exporter] export overran its interval by %.2fs' % -delay)
+            next_export_ts = time.monotonic()
 
 # validating configs
 if KOA_CONFIG.cost_model == 'CHARGE_BACK' and KOA_CONFIG.billing_hourly_rate <= 0.0: